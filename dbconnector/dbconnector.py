@@ -8,27 +8,50 @@ functionality.
 """
 
 from datetime import datetime
+from collections import deque, OrderedDict
+from collections.abc import Mapping
 import time as TIME
 import os
+import atexit
+import random
 import sys
-import inspect
-from logging import info, debug, warning, error, critical, exception
+import threading
+import queue
+import weakref
+from logging import info, debug, warning, error, critical, exception, getLogger, DEBUG
 import re
 from typing import Optional, Dict, List
 
-from pandas import DataFrame
 import mysql.connector
-from mysql.connector import errorcode, connection
+from mysql.connector import errorcode
+from mysql.connector.constants import FieldType
+from mysql.connector.abstracts import MySQLConnectionAbstract
+
+_MODULE_FILE = os.path.basename(__file__)
+_INSERT_VALUES_REGEX = re.compile(r"^\s*insert\b.+\bvalues\s*\(", re.IGNORECASE | re.DOTALL)
+_PREPARED_CACHE_SIZE = 32
+_INSERT_CHUNK_SIZE = 10000
+# mysql-connector-python 9.2 removed the `multi` arg of `cursor.execute()`; multiple statements are
+# always accepted and their results are read with `cursor.nextset()` instead
+_EXECUTE_MULTI_ARG = tuple(mysql.connector.__version_info__[:2]) < (9, 2)
+_NUMPY_DTYPES = {
+    FieldType.TINY: "int64",
+    FieldType.SHORT: "int64",
+    FieldType.INT24: "int64",
+    FieldType.LONG: "int64",
+    FieldType.LONGLONG: "int64",
+    FieldType.YEAR: "int64",
+    FieldType.FLOAT: "float64",
+    FieldType.DOUBLE: "float64",
+}
 
 class DBConnectorException(Exception):
     """An Exception specific to the DBConnector class."""
     def __init__(self, msg):
         try:
-            caller_file = inspect.stack()[2][1]
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-        except:
-            caller_file = os.path.basename(__file__)
+            caller_file = sys._getframe(2).f_code.co_filename
+        except ValueError:
+            caller_file = _MODULE_FILE
         error(msg)
         self.msg = f"{msg} (in '{caller_file}')"
 
@@ -36,83 +59,297 @@ class DBConnectorException(Exception):
         return self.msg
 
 class DBConnectorLog:
-    """Record, read and analyse DBConnector stats."""
-    def __init__(self, logfile, conn_args):
+    """
+    Record, read and analyse DBConnector stats.
+
+    Log lines are queued by *log_query* and written to the log file in batches by a background
+    thread, so that query latency does not depend on disk I/O. If the queue fills up (i.e. the disk
+    cannot keep up), further lines are dropped and counted in *self.dropped*. The log file and the
+    writer thread are only opened when the first line is logged, and *close* stops them again; a
+    closed log is reopened if more lines are logged.
+    """
+    # Maximum time (in seconds) that *close* waits for the writer thread to finish
+    close_timeout = 5.0
+
+    def __init__(self, logfile, conn_args, flush_interval=1.0, max_queue=10000):
         self.logfile = logfile
         self.status = {0: "success", 1: "error", 2: "warning"}
         if "option_files" in conn_args:
             _, self.host = os.path.split(conn_args["option_files"])
         else:
             self.host = f"{conn_args['host']}.{conn_args['user']}.{conn_args['database']}"
+        self._host_b = self.host.encode()
+        self._status_b = {k: v.encode() for k, v in self.status.items()}
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._fh = None
+        self._queue = None
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Open the log file and start the writer thread, unless another thread already has."""
+        with self._lock:
+            if self._writer is None:
+                self._fh = open(self.logfile, "ab", buffering=64 * 1024)
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._writer = threading.Thread(target=self._write_loop, name="DBConnectorLog",
+                                                args=(self._queue, self._fh), daemon=True)
+                self._writer.start()
+                atexit.register(self.close)
+            return self._queue
 
     def log_query(self, sql, start, time_taken, status=0, err=None):
-        """Append query details to the log file."""
+        """
+        Queue query details to be appended to the log file. *start* is the query start time in
+        seconds since the epoch, which is only converted to a datetime by the writer thread.
+        """
         if self.logfile is None:
             return
-        status = self.status[status]
-        with open(self.logfile, "ab") as log:
-            log.write(f"{datetime.utcnow()}|{self.host}|{start}|{sql}|{status}|{err}|"
-                      f"{time_taken}\n")
+        log_queue = self._queue
+        if log_queue is None:
+            log_queue = self._start()
+        try:
+            log_queue.put_nowait((TIME.time(), start, sql, status, err, time_taken))
+        except queue.Full:
+            self.dropped += 1
+
+    def _format(self, logged, start, sql, status, err, time_taken):
+        """Format a queued record as a line of the log file."""
+        return b"%b|%b|%b|%b|%b|%b|%b\n" % (
+            str(datetime.utcfromtimestamp(logged)).encode(), self._host_b,
+            str(datetime.utcfromtimestamp(start)).encode(),
+            str(sql).encode(errors="backslashreplace"), self._status_b[status],
+            str(err).encode(errors="backslashreplace"), str(time_taken).encode()
+        )
+
+    def _write_loop(self, log_queue, fh, batch_size=1000):
+        """
+        Drain *log_queue* in the background thread, writing up to *batch_size* lines at a time to
+        *fh* and flushing the file at most once every *self.flush_interval* seconds. A queued None
+        stops the loop. Errors are logged and the affected lines counted in *self.dropped*, so that
+        the thread keeps draining the queue (e.g. while the disk is full).
+        """
+        stop = False
+        failing = False
+        last_flush = TIME.monotonic()
+        while not stop:
+            lines = []
+            try:
+                record = log_queue.get(timeout=self.flush_interval)
+                while True:
+                    if record is None:
+                        stop = True
+                        break
+                    try:
+                        lines.append(self._format(*record))
+                    except Exception as err:
+                        self.dropped += 1
+                        warning(f"Failed to format query log line: {err}")
+                    if len(lines) >= batch_size:
+                        break
+                    record = log_queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                if lines:
+                    fh.write(b"".join(lines))
+                if stop or TIME.monotonic() - last_flush >= self.flush_interval:
+                    fh.flush()
+                    last_flush = TIME.monotonic()
+                failing = False
+            except Exception as err:
+                self.dropped += len(lines)
+                # Only warn once per run of failures, rather than for every batch
+                if not failing:
+                    warning(f"Failed to write to query log '{self.logfile}': {err}")
+                failing = True
+
+    def close(self):
+        """
+        Write any queued log lines, then flush and close the log file and stop the writer thread.
+        """
+        with self._lock:
+            if self._writer is None:
+                return
+            atexit.unregister(self.close)
+            writer, log_queue, fh = self._writer, self._queue, self._fh
+            self._writer, self._queue, self._fh = None, None, None
+        if writer.is_alive():
+            try:
+                log_queue.put(None, timeout=self.close_timeout)
+                writer.join(self.close_timeout)
+            except queue.Full:
+                pass
+        if writer.is_alive():
+            # Leave the file to the (daemon) writer rather than closing it mid-write
+            warning(f"Timed out waiting for query log '{self.logfile}' to be written")
+        else:
+            self.dropped += log_queue.qsize()
+            try:
+                fh.close()
+            except OSError as err:
+                warning(f"Failed to close query log '{self.logfile}': {err}")
+        if self.dropped:
+            warning(f"Dropped {self.dropped} query log lines because the log queue was full or "
+                    "the log file could not be written")
+            self.dropped = 0
 
 class DBConnectionPool:
-    """Handle connections to the DB manually rather than relying on MySQL connection pooling."""
-    def __init__(self, connector_args: Dict, pool_size: int):
-        self.conn_args = connector_args
-        self.connection_pool = []
+    """
+    Handle connections to the DB manually rather than relying on MySQL connection pooling.
+
+    The pool is safe to share between threads. When all *pool_size* connections are in use,
+    callers wait up to *timeout* seconds for one to be returned before giving up. Connections that
+    have been sat in the pool for more than *ping_after* seconds are checked before being reused.
+    Connections which are currently lent out are tracked in *self._lent* so that any which have not
+    been returned can be reported and closed by *DBConnectionPool.close_all*.
+    """
+    def __init__(
+        self,
+        connector_args: Dict,
+        pool_size: int,
+        timeout: Optional[float] = None,
+        ping_after: float = 30
+    ):
+        # Take a copy so that every connection in the pool is opened with the same args, even if the
+        # caller's dict is modified later
+        self.conn_args = dict(connector_args)
+        self.connection_pool = deque()
         self.connections = 0
         self.max_pool = pool_size
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._lent = weakref.WeakSet()
+        # Slots reserved by threads which are still opening a new connection
+        self._pending = 0
+        self._lock = threading.Condition()
 
     def _new_connection(self):
         """Create a new connection using *self.conn_args*."""
         return mysql.connector.connect(**self.conn_args)
 
+    def _available(self):
+        """Check whether a connection can be taken from the pool. Call with *self._lock* held."""
+        return bool(self.connection_pool) or self.connections < self.max_pool
+
     def _get_connection(self):
         """
         Take a connection out of the pool. If the pool is exhausted, either create a new connection
-        or raise a "Connection pool exhausted" exception if the maximum pool size has been reached.
-        This prevents creation of too many open connections.
+        or wait for another thread to return one if the maximum pool size has been reached. A
+        "Connection pool exhausted" exception is raised if no connection becomes available within
+        *self.timeout* seconds. This prevents creation of too many open connections. Connections
+        are taken LIFO so that the most recently used (and therefore warmest) connection is reused
+        first. Pooled connections which have been idle for more than *self.ping_after* seconds are
+        tested (which pings the server) and discarded if they are no longer usable.
         """
-        if len(self.connection_pool) > 0:
-            cnx = self.connection_pool[0]
-            self.connection_pool.pop(0)
-        else:
-            if self.connections < self.max_pool:
-                cnx = self._new_connection()
-                self.connections += 1
-            else:
-                raise DBConnectorException(msg="Connection pool exhausted.")
+        while True:
+            with self._lock:
+                if not self._lock.wait_for(self._available, timeout=self.timeout):
+                    raise DBConnectorException(msg="Connection pool exhausted.")
+                if not self.connection_pool:
+                    # Reserve the slot now but connect outside the lock so other threads are not
+                    # held up
+                    self.connections += 1
+                    self._pending += 1
+                    break
+                cnx = self.connection_pool.pop()
+                self._lent.add(cnx)
+            if TIME.monotonic() - cnx._dbc_returned < self.ping_after or cnx.is_connected():
+                return cnx
+            self._close_connection(cnx)
+        try:
+            cnx = self._new_connection()
+        except:
+            with self._lock:
+                self._pending -= 1
+                self.connections -= 1
+                self._lock.notify()
+            raise
+        with self._lock:
+            self._pending -= 1
+            self._lent.add(cnx)
         return cnx
 
-    def _return_connection(self, cnx):
+    def _return_connection(self, cnx, known_good=False):
         """
         Return a connection to the pool. Incoming connections are tested and if they are no longer
         usable will be disgarded using *DBConnectionPool._close_connection*, which frees up the
-        slot.
+        slot. Connections with unread results (e.g. from a query which failed part-way through a
+        multi-statement result) are also disgarded, since their reused cursor could not execute
+        another query. Set *known_good* to True to skip the test (which may ping the server) when
+        the caller has just used the connection successfully.
         """
-        if isinstance(cnx, connection.MySQLConnection) and cnx.is_connected():
-            self.connection_pool.append(cnx)
+        if known_good or (isinstance(cnx, MySQLConnectionAbstract) and not cnx.unread_result
+                          and cnx.is_connected()):
+            cnx._dbc_returned = TIME.monotonic()
+            with self._lock:
+                # A connection which is no longer lent out has already been closed by close_all()
+                if cnx in self._lent:
+                    self._lent.discard(cnx)
+                    self.connection_pool.append(cnx)
+                    self._lock.notify()
         else:
             self._close_connection(cnx)
         return
 
     def _close_connection(self, cnx):
-        """Permanently close a connection and free up a slot in *self.connections*."""
-        if isinstance(cnx, connection.MySQLConnection):
+        """
+        Permanently close a connection and free up a slot in *self.connections*. `None` (i.e. a
+        connection that was never successfully taken from the pool) does not hold a slot and is
+        ignored, as is a connection that has already been closed by *DBConnectionPool.close_all*.
+        """
+        if cnx is None:
+            return
+        self._close(cnx)
+        with self._lock:
+            if cnx in self._lent:
+                self._lent.discard(cnx)
+                self.connections -= 1
+                self._lock.notify()
+        return
+
+    def _close(self, cnx):
+        """Close a connection and any cursors cached on it, without updating the slot count."""
+        if isinstance(cnx, MySQLConnectionAbstract):
             try:
+                cursor = getattr(cnx, "_dbc_cursor", None)
+                if cursor is not None:
+                    cursor.close()
+                for cursor in getattr(cnx, "_dbc_prepared", {}).values():
+                    cursor.close()
                 cnx.close()
             except KeyboardInterrupt:
                 raise KeyboardInterrupt
             except:
                 self.warning("Failed to close connection...")
-        self.connections -= 1
         return
 
     def close_all(self):
-        """Close all connections when done with them for maximum DB efficiency."""
-        for cnx in self.connection_pool:
-            self._close_connection(cnx)
-        if self.connections != 0:
-            self.warning("Failed to account for all connections in DBConnectionPool.close_all()")
+        """
+        Close all connections when done with them for maximum DB efficiency. Connections which are
+        still lent out (i.e. were never returned to the pool) are forcibly closed too, with a
+        warning. Slots reserved by threads which are still opening a connection are kept. Any
+        remaining slots belong to connections which were garbage collected without being returned;
+        these are reported and freed.
+        """
+        with self._lock:
+            pooled = list(self.connection_pool)
+            self.connection_pool.clear()
+            lent = list(self._lent)
+            self._lent.clear()
+            leaked = self.connections - len(pooled) - len(lent) - self._pending
+            self.connections = self._pending
+            self._lock.notify_all()
+        for cnx in pooled + lent:
+            self._close(cnx)
+        if lent:
+            self.warning(f"Closed {len(lent)} connection(s) which had not been returned to the "
+                         "pool in DBConnectionPool.close_all()")
+        if leaked != 0:
+            self.warning(f"Failed to account for {leaked} connection(s) in "
+                         "DBConnectionPool.close_all()")
         return
 
     def warning(self, msg: str):
@@ -142,19 +379,31 @@ class DBConnector:
         - `buffered`: True
         - `get_warnings`: True
         - `raise_on_warnings`: False
-        - `use_pure`: True
+        - `use_pure`: False if the C extension is available, otherwise True
     query_log : string, optional
         Optionally specify a log file where query stats will be logged.
     pool_size : int, optional
         Optionally specify the maximum pool size (i.e. number of connections open at any time).
-        Default is 1.
+        Connections are only opened when needed, so this is a cap rather than a number that will
+        always be opened. Set it to roughly the number of threads that will query the database
+        concurrently, keeping well within the server's `max_connections`. Default is 10.
+    pool_timeout : float, optional
+        Optionally specify the time (in seconds) to wait for a connection to be returned to the
+        pool when all *pool_size* connections are in use by other threads. Default is 10.
     cnx_retries : int, optional
         Optionally specify the maximum number of times to retry failed connections/queries.
         Default is 10.
     sleep_interval : int, optional
         Optionally specify time (in seconds) to sleep inbetween failed connections/queries which are
-        retried. This code uses an exponentil back-off, so the sleep time will double after each
-        failed connection / query - this arg determines the initial sleep time. Default is 1.
+        retried. This code uses a jittered exponential back-off, so the sleep time will grow after
+        each failed connection / query - this arg determines the initial sleep time. Default is 1.
+    max_backoff : float, optional
+        Optionally specify the maximum time (in seconds) to sleep inbetween retries. The back-off
+        is randomly jittered to avoid many clients retrying in lock-step. Default is 10.
+    test_on_start : boolean, optional
+        Set to True to submit a test query when the DBConnector is created, so that connection
+        errors are raised immediately rather than on the first query. This costs an extra
+        round-trip to the server. Default is False.
 
     Notes
     -----
@@ -164,9 +413,12 @@ class DBConnector:
         self,
         connector_args: Dict,
         query_log: Optional[str] = None,
-        pool_size: int = 1,
+        pool_size: int = 10,
         cnx_retries: int = 10,
-        sleep_interval: int = 1
+        sleep_interval: int = 1,
+        pool_timeout: float = 10,
+        max_backoff: float = 10,
+        test_on_start: bool = False,
     ) -> None:
         self.connector_args = {
             "time_zone": "UTC",
@@ -174,11 +426,11 @@ class DBConnector:
             "buffered": True,
             "get_warnings": True,
             "raise_on_warnings": False,
-            "use_pure": True,
+            "use_pure": not mysql.connector.HAVE_CEXT,
+            **connector_args,
         }
-        self.connector_args.update(connector_args)
-        self.pool = DBConnectionPool(self.connector_args, pool_size)
-        self.retry_errors = (
+        self.pool = DBConnectionPool(self.connector_args, pool_size, pool_timeout)
+        self.retry_errors = frozenset((
             #Can't connect to MySQL server on...
             errorcode.CR_CONN_HOST_ERROR,
             errorcode.CR_IPSOCK_ERROR,
@@ -193,12 +445,15 @@ class DBConnector:
             errorcode.ER_SERVER_SHUTDOWN,
             #Lock wait timeout exceeded (maybe extend timeout?)
             errorcode.ER_LOCK_WAIT_TIMEOUT,
-        )
-        debug(f"config: {self._redacted_connector_args()}")
+        ))
+        if getLogger().isEnabledFor(DEBUG):
+            debug("config: %s", self._redacted_connector_args())
         self.sleep_interval = sleep_interval
+        self.max_backoff = max_backoff
         self.cnx_retries = cnx_retries
         self.query_log = DBConnectorLog(query_log, self.connector_args)
-        self._test_query()
+        if test_on_start:
+            self._test_query()
 
     def __enter__(self):
         """Enter the context manager. Test the connection and log a debug message."""
@@ -210,13 +465,10 @@ class DBConnector:
     def _test_query(self):
         """
         Create a new connection and submit a test query to see if the connection has been
-        successful. Used to ensure any failure to connection errors occur at the point of creating
-        the DBConnector instance rather than waiting until the first query is made.
+        successful. Used when *test_on_start* is True to ensure any failure to connection errors
+        occur at the point of creating the DBConnector instance rather than waiting until the first
+        query is made.
         """
-        cnx_retries = self.cnx_retries
-        self.cnx_retries = 3
-        connection_timeout = self.connector_args["connection_timeout"]
-        self.pool.conn_args["connection_timeout"] = 5
         debug("submitting test query")
         try:
             self.query("SELECT 1;")
@@ -226,90 +478,68 @@ class DBConnector:
             debug("test query failed")
             raise
         debug("test query successful")
-        self.cnx_retries = cnx_retries
-        self.pool.conn_args["connection_timeout"] = connection_timeout
         return
 
     def _redacted_connector_args(self):
         return {k: v if k!="password" else "REDACTED" for k, v in self.connector_args.items()}
 
-    def _connect(self):
+    def _acquire_connection(self):
         """
-        Open a connection to the database. Use connection pooling to reduce new connections.
+        Take a connection to the database from the pool, retrying with back-off up to
+        *self.cnx_retries* times if the connection fails due to one of *self.retry_errors*.
 
         Returns
         -------
-        mysql.connector.connection.MySQLConnection
-            Database connection object.
+        mysql.connector.abstracts.MySQLConnectionAbstract
+            Database connection object (either the pure Python or the C extension implementation).
         See Also
         --------
-        `MySQL Connector Python Docs <https://dev.mysql.com/doc/connector-python/en/index.html>`_,
-        `MySQL Connection Pooling Docs
-        <https://dev.mysql.com/doc/connector-python/en/connector-python-connection-pooling.html>`_
-        Notes
-        -----
-        If a connection pool is not yet opened, then calling a mysql.connector.connect() with the
-        *pool_size* option will open a new pool and return a connection. If a connection pool with
-        the same name is already open, then a connection will be returned from that pool.
-        By not setting the pool_name parameter, the connect() function automatically generates the
-        name, composed from whichever of the host, port, user, and database connection arguments are
-        given.
-        """
-        cnx = None
-        try:
-            cnx = self.pool._get_connection()
-        except mysql.connector.Error as err:
-            if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-                raise DBConnectorException("Something is wrong with the mysql username or "
-                                           "password.")
-            elif err.errno == errorcode.ER_BAD_DB_ERROR:
-                raise DBConnectorException("The database does not exist.")
-            elif err.errno in self.retry_errors:
+        `MySQL Connector Python Docs <https://dev.mysql.com/doc/connector-python/en/index.html>`_
+        """
+        sleep_interval = self.sleep_interval
+        # Always make at least one attempt, even if *self.cnx_retries* is 0
+        attempts = max(1, self.cnx_retries)
+        for attempt in range(1, attempts + 1):
+            try:
+                return self.pool._get_connection()
+            except mysql.connector.Error as err:
+                if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
+                    raise DBConnectorException("Something is wrong with the mysql username or "
+                                               "password.")
+                elif err.errno == errorcode.ER_BAD_DB_ERROR:
+                    raise DBConnectorException("The database does not exist.")
+                elif err.errno not in self.retry_errors:
+                    raise
                 warning(f"MySQL Connector Error: {err}")
-                self.pool._return_connection(cnx)
-                return None
-            else:
-                raise
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-        except:
-            raise
-        return cnx
+            if attempt < attempts:
+                warning(f"Connection failed - retrying in {sleep_interval:.2f} seconds")
+                TIME.sleep(sleep_interval)
+                sleep_interval = self._backoff(sleep_interval)
+        raise DBConnectorException(f"Failed to connect to the DB after {self.cnx_retries} "
+                                   f"retries.")
 
-    def _connect_retry(self, cnx_retries=1):
-        """Get a connection to the database with optional retries."""
-        retries = 0
-        test = False
-        sleep_interval = self.sleep_interval
-        while not test:
-            cnx = self._connect()
-            retries += 1
-            if cnx is None:
-                test = False
-            else:
-                test = cnx.is_connected()
-            if not test:
-                if retries < cnx_retries:
-                    warning(f"Connection failed - retrying in {self.sleep_interval} seconds")
-                    self.pool._return_connection(cnx)
-                    test = False
-                    TIME.sleep(sleep_interval)
-                    sleep_interval *= 2
-                else:
-                    #import pdb; pdb.set_trace()
-                    raise DBConnectorException(f"Failed to connect to the DB after {cnx_retries} "
-                                               f"retries.")
-        return cnx
+    def _backoff(self, sleep_interval):
+        """
+        Get the next sleep interval for a retry using exponential back-off with decorrelated jitter,
+        capped at *self.max_backoff*. The jitter stops clients that failed together from retrying
+        together.
+        """
+        return min(self.max_backoff, random.uniform(self.sleep_interval, sleep_interval * 3))
 
-    def _safe_query(self, query_type, **kwargs):
+    def _safe_query(self, query_type, *args, stream=False):
         """
         Execute an SQL statement with added resilience.
 
         Parameters
         ----------
         `query_type` : DBConnector class method
-            One of *DBConnector._select_query*, *DBConnector._proc_query*,
+            One of *DBConnector._select_query*, *DBConnector._stream_select_query*,
+            *DBConnector._multi_select_query*, *DBConnector._proc_query*,
             *DBConnector._iud_query*.
+        `stream` : boolean, optional
+            Set to True when `query_type` returns an unbuffered cursor. The connection is not
+            returned to the pool; instead a tuple of (connection, cursor) is returned and the caller
+            is responsible for releasing the connection (see *DBConnector._stream_rows*).
 
         Returns
         -------
@@ -318,48 +548,99 @@ class DBConnector:
             <https://dev.mysql.com/doc/connector-python/en/index.html>`__.
         Notes
         -----
-        Any additional arguments required by the query methods must be supplied as *kwargs*.
+        Any additional arguments required by the query methods must be supplied positionally as
+        *args*, the first of which is recorded in the query log.
         This method retries failed queries due to *retry_errors* with exponential back-off.
         Queries that fail due to failure to retrieve a connection also retry
         with exponential back-off, but only up to *self.cnx_retries* times.
         """
         success = False
         sleep_interval = self.sleep_interval
+        log_queries = self.query_log.logfile is not None
         while not success:
-            cnx = self._connect_retry(cnx_retries=self.cnx_retries)
-            start = datetime.utcnow()
+            cnx = self._acquire_connection()
+            start = TIME.time() if log_queries else None
+            start_ns = TIME.perf_counter_ns()
             try:
-                result = query_type(cnx, **kwargs)
+                result = query_type(cnx, *args)
+                if log_queries:
+                    time_taken = (TIME.perf_counter_ns() - start_ns) * 1e-9
+                    self.query_log.log_query(args[0], start, time_taken)
                 success = True
-                if self.query_log is not None:
-                    time_taken = (datetime.utcnow() - start).total_seconds()
-                    sql = kwargs.get("sqlquery", None)
-                    self.query_log.log_query(sql, start, time_taken)
             except mysql.connector.Error as err:
-                if err.errno in self.retry_errors:
-                    if self.query_log is not None:
-                        time_taken = (datetime.utcnow() - start).total_seconds()
-                        sql = kwargs.get("sqlquery", None)
-                        self.query_log.log_query(sql, start, time_taken, 1, err)
-                    self.pool._return_connection(cnx)
-                    warning(f"MySQL Error: {err}")
-                    TIME.sleep(sleep_interval)
-                    sleep_interval *= 2
-                else:
-                    self.pool._return_connection(cnx)
+                if err.errno not in self.retry_errors:
                     raise
+                if log_queries:
+                    time_taken = (TIME.perf_counter_ns() - start_ns) * 1e-9
+                    self.query_log.log_query(args[0], start, time_taken, 1, err)
+                warning(f"MySQL Error: {err}")
             except KeyboardInterrupt:
                 raise KeyboardInterrupt
+            except DBConnectorException:
+                raise
             except:
-                self.pool._return_connection(cnx)
                 err = sys.exc_info()[0]
                 raise DBConnectorException(f"Encountered an error during MySQL query ({err}).")
-        self.pool._return_connection(cnx)
+            finally:
+                # A streamed result keeps its connection until the rows have been consumed. A failed
+                # query may have left earlier statements uncommitted, so roll them back before the
+                # connection is reused (e.g. by the retry); if that fails, don't reuse it at all
+                if not success and not self._rollback(cnx):
+                    self.pool._close_connection(cnx)
+                elif not (success and stream):
+                    self.pool._return_connection(cnx, known_good=success)
+            if not success:
+                TIME.sleep(sleep_interval)
+                sleep_interval = self._backoff(sleep_interval)
+        if stream:
+            return cnx, result
         return result
 
+    @staticmethod
+    def _rollback(cnx):
+        """Roll back any open transaction on *cnx*, returning False if this fails."""
+        try:
+            cnx.rollback()
+        except Exception:
+            return False
+        return True
+
+    def _stream_rows(self, sqlquery, df=False, chunk_size=10000):
+        """
+        Execute *sqlquery* using an unbuffered cursor and read the rows in batches of *chunk_size*,
+        yielding either individual rows or, if *df* is True, one DataFrame per batch. The query is
+        only executed (and a connection taken from the pool) once iteration starts, so a generator
+        that is never iterated holds nothing. The connection is then held until the rows are
+        exhausted or the generator is closed. A connection abandoned part-way through a result set
+        still has unread rows, so it is closed rather than returned to the pool.
+        """
+        cnx, cursor = self._safe_query(self._stream_select_query, sqlquery, stream=True)
+        exhausted = False
+        try:
+            description = cursor.description
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if df:
+                    yield self._to_dataframe(rows, description)
+                else:
+                    yield from rows
+            exhausted = True
+        finally:
+            if exhausted:
+                cursor.close()
+                self.pool._return_connection(cnx, known_good=True)
+            else:
+                self.pool._close_connection(cnx)
+
     def close_connections(self):
-        """Close all connections when finished for optimal DB efficiency."""
+        """
+        Close all connections when finished for optimal DB efficiency. The query log (if any) is
+        also flushed and closed; it is reopened automatically if the DBConnector is used again.
+        """
         self.pool.close_all()
+        self.query_log.close()
 
     @staticmethod
     def _safe_close(cnx):
@@ -378,56 +659,252 @@ class DBConnector:
         return
 
     @staticmethod
-    def _select_query(cnx, **kwargs):
+    def _cursor(cnx):
+        """
+        Get the default cursor for *cnx*, creating it on first use. The cursor is kept on the
+        connection and reused by later queries until *DBConnectionPool._close_connection* closes it.
+        """
+        cursor = getattr(cnx, "_dbc_cursor", None)
+        if cursor is None:
+            cursor = cnx._dbc_cursor = cnx.cursor()
+        return cursor
+
+    @staticmethod
+    def _prepared_cursor(cnx, sqlquery):
+        """
+        Get a prepared statement cursor for *sqlquery* on *cnx*, preparing it on first use. Prepared
+        cursors are cached on the connection by SQL text and closed along with the connection. At
+        most *_PREPARED_CACHE_SIZE* are kept per connection (least recently used are closed first)
+        since prepared statements count towards the server's max_prepared_stmt_count.
+        """
+        prepared = getattr(cnx, "_dbc_prepared", None)
+        if prepared is None:
+            prepared = cnx._dbc_prepared = OrderedDict()
+        cursor = prepared.get(sqlquery)
+        if cursor is None:
+            if len(prepared) >= _PREPARED_CACHE_SIZE:
+                prepared.popitem(last=False)[1].close()
+            # Prepared cursors cannot be buffered, so override the connection's `buffered` default
+            cursor = prepared[sqlquery] = cnx.cursor(prepared=True, buffered=False)
+        else:
+            prepared.move_to_end(sqlquery)
+        return cursor
+
+    @staticmethod
+    def _select_query(cnx, sqlquery, df=False, prepared=False):
         """Execute a select query."""
-        sqlquery = kwargs.get("sqlquery", None)
-        debug(f"select query: {sqlquery}")
-        df = kwargs.get("df", False)
-        cursor = cnx.cursor()
+        debug("select query: %s", sqlquery)
+        if prepared:
+            cursor = DBConnector._prepared_cursor(cnx, sqlquery)
+        else:
+            cursor = DBConnector._cursor(cnx)
         cursor.execute(sqlquery)
         result = cursor.fetchall()
-        cursor.close()
+        description = cursor.description
+        if not prepared:
+            cursor.reset()
         if df:
             debug("converting query result to dataframe")
-            col_regex = "(?<=^select)[a-zA-Z0-9_\s*(),`]+(?=from)"
-            cols = [c.strip().split(" as ")[-1].strip().strip("`") for c in
-                    re.findall(col_regex, sqlquery.lower())[0].strip().split(",")]
-            return DataFrame(result, columns=cols)
+            return DBConnector._to_dataframe(result, description)
         return result
 
     @staticmethod
-    def _proc_query(cnx, **kwargs):
+    def _stream_select_query(cnx, sqlquery):
+        """Execute a select query using an unbuffered cursor, returning the cursor to read from."""
+        debug("streamed select query: %s", sqlquery)
+        cursor = cnx.cursor(buffered=False)
+        cursor.execute(sqlquery)
+        return cursor
+
+    @staticmethod
+    def _to_dataframe(result, description):
+        """
+        Convert a list of row tuples into a DataFrame, building each column directly as a typed
+        array where the MySQL field type allows it so that Pandas does not have to infer dtypes from
+        an intermediate object array. Columns containing NULLs (or values that do not fit the
+        expected dtype) fall back to Pandas' own inference.
+        """
+        # Imported here rather than at module level so that users who never request DataFrames
+        # don't pay the (considerable) import time of Pandas
+        import numpy as np
+        from pandas import DataFrame
+        cols = [d[0].lower() for d in description]
+        if not result:
+            return DataFrame([], columns=cols)
+        data = {}
+        for i, (desc, values) in enumerate(zip(description, zip(*result))):
+            dtype = _NUMPY_DTYPES.get(desc[1])
+            if dtype is not None:
+                try:
+                    data[i] = np.asarray(values, dtype=dtype)
+                    continue
+                except (TypeError, ValueError, OverflowError):
+                    pass
+            data[i] = values
+        # The column arrays were built just for this DataFrame, so there is no need to copy them
+        df = DataFrame(data, copy=False)
+        df.columns = cols
+        return df
+
+    @staticmethod
+    def _multi_select_query(cnx, sqlquery, n_queries, df=False):
+        """
+        Execute several select queries as a single multi-statement query, checking that one result
+        is returned for each of the *n_queries* queries.
+        """
+        debug("multi-statement select query: %s", sqlquery)
+        cursor = DBConnector._cursor(cnx)
+        results = []
+        for result in DBConnector._execute_multi(cursor, sqlquery):
+            rows = result.fetchall() if result.with_rows else []
+            if df:
+                rows = DBConnector._to_dataframe(rows, result.description or [])
+            results.append(rows)
+        cursor.reset()
+        if len(results) != n_queries:
+            raise DBConnectorException(f"Expected {n_queries} results from multi-statement query "
+                                       f"but received {len(results)}.")
+        return results
+
+    @staticmethod
+    def _proc_query(cnx, proc, proc_args):
         """Execute a MySQL procedure."""
-        proc = kwargs.get("proc", None)
-        proc_args = kwargs.get("proc_args", None)
-        debug(f"procedure call: call {proc}({', '.join(map(str, proc_args))})")
-        cursor = cnx.cursor()
+        debug("procedure call: call %s(%s)", proc, proc_args)
+        cursor = DBConnector._cursor(cnx)
         result = []
         cursor.callproc(proc, proc_args)
         for res in cursor.stored_results():
             result.append(res.fetchall())
-        cursor.close()
+        cursor.reset()
         return result
 
     @staticmethod
-    def _iud_query(cnx, **kwargs):
+    def _iud_query(cnx, sqlquery, data=None, chunk_size=None, pipeline=True):
         """Execute an insert/update/delete SQL statement."""
-        chunk_size = kwargs.get("chunk_size", 1000)
-        data = kwargs.get("data", None)
-        sqlquery = kwargs.get("sqlquery", None)
-        debug(f"insert/update/delete query: {sqlquery}")
-        cursor = cnx.cursor()
+        debug("insert/update/delete query: %s", sqlquery)
+        cursor = DBConnector._cursor(cnx)
         if data is None:
             cursor.execute(sqlquery)
+            affected = cursor.rowcount
         else:
-            for i in range(0, len(data), chunk_size):
-                cursor.executemany(sqlquery, data[i:(i+chunk_size)])
+            # `executemany()` already rewrites "INSERT ... VALUES" into a single multi-row
+            # statement, but other statements are sent one row at a time unless we pipeline them
+            # ourselves. If they are sent row by row, use a prepared statement so the server only
+            # parses them once. Rows given as mappings (for "%(name)s" placeholders) are left to
+            # `executemany()` on the default cursor, since their params can neither be flattened
+            # for pipelining nor bound to a prepared statement
+            is_insert = _INSERT_VALUES_REGEX.match(sqlquery) is not None
+            named = bool(data) and isinstance(data[0], Mapping)
+            pipeline = (pipeline and not is_insert and not named
+                        and DBConnector._supports_multi(cursor))
+            if is_insert:
+                chunks = DBConnector._packet_chunks(cnx, sqlquery, data,
+                                                    chunk_size or _INSERT_CHUNK_SIZE)
+            elif pipeline:
+                chunks = DBConnector._packet_chunks(cnx, sqlquery, data, chunk_size or 1000,
+                                                    repeated=True)
+            else:
+                chunk_size = chunk_size or 1000
+                chunks = (data if chunk_size >= len(data) else data[i:(i+chunk_size)]
+                          for i in range(0, len(data), chunk_size))
+            if is_insert or pipeline or named:
+                many_cursor = cursor
+            else:
+                many_cursor = DBConnector._prepared_cursor(cnx, sqlquery)
+            affected = 0
+            for chunk in chunks:
+                if pipeline:
+                    affected += DBConnector._pipelined_execute(cursor, sqlquery, chunk)
+                else:
+                    many_cursor.executemany(sqlquery, chunk)
+                    affected += many_cursor.rowcount
         cnx.commit()
-        affected = cursor.rowcount
-        cursor.close()
+        cursor.reset()
+        return affected
+
+    @staticmethod
+    def _packet_chunks(cnx, sqlquery, data, chunk_size, repeated=False):
+        """
+        Split *data* into chunks of at most *chunk_size* rows, ending a chunk early if the query
+        built from it is not expected to fit within the server's max_allowed_packet. The size of
+        each row is estimated (generously) from its own values, so uneven rows (e.g. variable length
+        text) are accounted for. By default *sqlquery* is sent once per chunk, as for the multi-row
+        INSERT built by `executemany()`. Set *repeated* to True if it is sent once per row, as for a
+        pipelined multi-statement query.
+        """
+        if not data:
+            return
+        budget = DBConnector._max_allowed_packet(cnx)
+        sql_size = len(sqlquery.encode()) + 2
+        if not repeated:
+            budget -= sql_size
+        start = 0
+        size = 0
+        for i, row in enumerate(data):
+            values = row.values() if isinstance(row, Mapping) else row
+            row_size = 2 * len(str(tuple(values)).encode())
+            if repeated:
+                row_size += sql_size
+            if i > start and (i - start >= chunk_size or size + row_size > budget):
+                yield data[start:i]
+                start = i
+                size = 0
+            size += row_size
+        yield data if start == 0 else data[start:]
+
+    @staticmethod
+    def _max_allowed_packet(cnx):
+        """Get the server's max_allowed_packet for *cnx*, querying it once per connection."""
+        max_allowed_packet = getattr(cnx, "_dbc_max_allowed_packet", None)
+        if max_allowed_packet is None:
+            cursor = DBConnector._cursor(cnx)
+            cursor.execute("SELECT @@max_allowed_packet;")
+            max_allowed_packet = cnx._dbc_max_allowed_packet = int(cursor.fetchone()[0])
+            cursor.reset()
+        return max_allowed_packet
+
+    @staticmethod
+    def _pipelined_execute(cursor, sqlquery, chunk):
+        """
+        Execute *sqlquery* once for each row in *chunk* using a single multi-statement round-trip.
+        """
+        # Separate the statements with newlines so that a trailing "-- ..." or "# ..." comment
+        # cannot swallow the statements after it
+        statement = ";\n".join([sqlquery.strip().rstrip(";")] * len(chunk))
+        params = [value for row in chunk for value in row]
+        affected = 0
+        for result in DBConnector._execute_multi(cursor, statement, params):
+            affected += max(result.rowcount, 0)
         return affected
 
-    def query(self, sqlquery: str, df: bool = False):
+    @staticmethod
+    def _supports_multi(cursor):
+        """Check whether *cursor* can execute multiple statements in one query."""
+        return _EXECUTE_MULTI_ARG or hasattr(cursor, "nextset")
+
+    @staticmethod
+    def _execute_multi(cursor, sqlquery, params=()):
+        """
+        Execute a multi-statement *sqlquery* on *cursor*, yielding a cursor positioned on the
+        result of each statement in turn. Works with both the `multi=True` API of
+        mysql-connector-python < 9.2 and the `nextset()` API which replaced it.
+        """
+        if _EXECUTE_MULTI_ARG:
+            yield from cursor.execute(sqlquery, params, multi=True)
+            return
+        cursor.execute(sqlquery, params)
+        yield cursor
+        while cursor.nextset():
+            yield cursor
+
+    def query(
+        self,
+        sqlquery: str,
+        df: bool = False,
+        stream: bool = False,
+        prepared: bool = False,
+        chunk_size: int = 10000
+    ):
         """
         Query the database using a select statement.
 
@@ -436,20 +913,65 @@ class DBConnector:
         sqlquery : string
             SQL statement to be executed.
         df : boolean, optional
-            Set to True to return query results as Pandas DataFrame. Column names will be extracted
-            from the *sqlquery* and converted to lowercase (do not use "select * from").
+            Set to True to return query results as Pandas DataFrame. Column names are taken from the
+            result set returned by the server (so aliases and "select * from" are supported) and
+            converted to lowercase.
+        stream : boolean, optional
+            Set to True to return a generator which yields rows as they are read from the server
+            using an unbuffered cursor, rather than reading the entire result set into memory. The
+            query is executed when iteration starts, and a connection is held from the pool until
+            the generator is exhausted or closed.
+        prepared : boolean, optional
+            Set to True to execute `sqlquery` as a server-side prepared statement. The statement is
+            cached on the connection, so repeating the same query skips parsing it on the server and
+            rows are returned using the binary protocol. Only worthwhile for queries that are run
+            many times with identical SQL text. Ignored if `stream=True`.
+        chunk_size : int, optional
+            When `stream=True`, the number of rows to read from the server at a time. Default is
+            10000.
 
         Returns
         -------
-        list *OR* Pandas DataFrame
+        list *OR* Pandas DataFrame *OR* generator
             If `df=False`, returns a list of tuples, [(R1C1, R1C2, ...), (R2C1, R2C2, ...), ...].
             Length of list corresponds to N rows returned, length of tuples corresponds to columns
             selected.
 
             If `df=True`, returns a Pandas DataFrame containing the columns from the `sqlquery` and
             any rows returned.
+
+            If `stream=True`, returns a generator yielding one tuple per row, or if `df=True` as
+            well, a generator yielding one Pandas DataFrame per `chunk_size` rows.
         """
-        return self._safe_query(self._select_query, sqlquery=sqlquery, df=df)
+        if stream:
+            return self._stream_rows(sqlquery, df, chunk_size)
+        return self._safe_query(self._select_query, sqlquery, df, prepared)
+
+    def queryall(self, sqlqueries: List[str], df: bool = False):
+        """
+        Query the database using several select statements, submitted to the server together in a
+        single round-trip.
+
+        Parameters
+        ----------
+        sqlqueries : list of strings
+            SQL statements to be executed, in order.
+        df : boolean, optional
+            Set to True to return each query's results as a Pandas DataFrame, as for
+            *DBConnector.query*.
+
+        Returns
+        -------
+        list
+            A list with one entry per statement in `sqlqueries`, each in the format returned by
+            *DBConnector.query*.
+        """
+        if not sqlqueries:
+            raise DBConnectorException("No queries were given to DBConnector.queryall().")
+        # Separate the queries with newlines so that a trailing "-- ..." or "# ..." comment cannot
+        # swallow the queries after it
+        sqlquery = ";\n".join(q.strip().rstrip(";") for q in sqlqueries)
+        return self._safe_query(self._multi_select_query, sqlquery, len(sqlqueries), df)
 
     def proc(self, proc: str, proc_args: List):
         """
@@ -467,9 +989,15 @@ class DBConnector:
         list
             A list of stored results, see `here <https://dev.mysql.com/doc/connector-python/en/connector-python-api-mysqlcursor-stored-results.html>`_.
         """
-        return self._safe_query(self._proc_query, proc=proc, proc_args=proc_args)
+        return self._safe_query(self._proc_query, proc, proc_args)
 
-    def iud_query(self, sqlquery: str, data: Optional[List[List]] = None, chunk_size: int = 1000):
+    def iud_query(
+        self,
+        sqlquery: str,
+        data: Optional[List[List]] = None,
+        chunk_size: Optional[int] = None,
+        pipeline: bool = True
+    ):
         """
         Execute an insert/update/delete SQL statement.
         
@@ -484,12 +1012,24 @@ class DBConnector:
         chunk_size : int, optional
             Optionally break the insert up into chunks of this size when using `data` to pass
             values. This can be useful if inserts to the DB are slow as shorter lived SQL queries
-            are generally preferred.
+            are generally preferred. Defaults to the `DBCONNECTOR_BATCH_SIZE` environment variable
+            if set. Otherwise "INSERT ... VALUES" statements are sent in chunks of 10000 and other
+            statements in chunks of 1000. For "INSERT ... VALUES" statements and pipelined
+            statements (see `pipeline`) the chunk size is always reduced automatically if a chunk
+            would be too large for max_allowed_packet.
+        pipeline : boolean, optional
+            When using `data` with a statement other than "INSERT ... VALUES" (e.g. an UPDATE or
+            DELETE), send each chunk as a single multi-statement query rather than one query per
+            row. If False (or if the installed connector cannot execute multiple statements), rows
+            are sent one at a time using a server-side prepared statement, which is cached on the
+            connection and reused by later calls. Rows given as dicts (for "%(name)s" placeholders)
+            are always sent one at a time without a prepared statement. Default is True.
 
         Returns
         -------
         int
             The number of rows affected.
         """
-        return self._safe_query(self._iud_query, sqlquery=sqlquery, data=data,
-                                chunk_size=chunk_size)
+        if chunk_size is None and "DBCONNECTOR_BATCH_SIZE" in os.environ:
+            chunk_size = int(os.environ["DBCONNECTOR_BATCH_SIZE"])
+        return self._safe_query(self._iud_query, sqlquery, data, chunk_size, pipeline)
@@ -82,7 +82,7 @@ setup(
     # requirements files see:
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
-        "mysql-connector-python>=8.0", "pandas>1.0.0",
+        "mysql-connector-python>=8.0", "numpy", "pandas>1.0.0",
     ],
 
     # List additional groups of dependencies here (e.g. development